@@ -13,10 +13,39 @@ TD_INCLUDE=${TD_INCLUDE:-"/opt/teradata/client/include"}
 ARROW_INCLUDE=${ARROW_INCLUDE:-"/usr/local/include"}
 ARROW_LIB=${ARROW_LIB:-"/usr/local/lib"}
 
+# Profile-guided optimization:
+#   1. PGO=generate ./scripts/build_teradata.sh and register the instrumented .so
+#   2. Run a representative export; the UDF process writes .gcda files to PGO_DIR on each node
+#   3. Copy PGO_DIR from a node back to the same path on the build host
+#   4. PGO=use ./scripts/build_teradata.sh from the same checkout and register the result
+# PGO_DIR must be absolute: the profile is written relative to the Teradata UDF
+# process, not the build tree, and must be writable by that process on the node.
+# EXTRA_CFLAGS (e.g. -march=native) should only target the CPUs of the Teradata nodes.
+PGO=${PGO:-""}
+PGO_DIR=${PGO_DIR:-"/var/opt/teradata/tdtemp/pgo"}
+EXTRA_CFLAGS=${EXTRA_CFLAGS:-""}
+
+if [ -n "$PGO" ] && [ "${PGO_DIR#/}" = "$PGO_DIR" ]; then
+    echo "PGO_DIR must be an absolute path: $PGO_DIR"; exit 1
+fi
+
+case "$PGO" in
+    generate) PGO_FLAGS="-fprofile-generate=$PGO_DIR" ;;
+    use)
+        # -fprofile-correction would otherwise hide a missing profile
+        if ! ls "$PGO_DIR"/*.gcda >/dev/null 2>&1; then
+            echo "No profile data in $PGO_DIR; copy it back from a Teradata node first"; exit 1
+        fi
+        PGO_FLAGS="-fprofile-use=$PGO_DIR -fprofile-correction"
+        ;;
+    "")       PGO_FLAGS="" ;;
+    *)        echo "Unknown PGO mode: $PGO (expected generate or use)"; exit 1 ;;
+esac
+
 mkdir -p $BUILD_DIR
 
 echo "Compiling Teradata Table Operator..."
-g++ -shared -fPIC -O3 \
+g++ -shared -fPIC -O3 $PGO_FLAGS $EXTRA_CFLAGS \
     -I$TD_INCLUDE \
     -Isrc/teradata/include \
     -I$ARROW_INCLUDE \
@@ -27,4 +56,4 @@ g++ -shared -fPIC -O3 \
     -o $BUILD_DIR/$TARGET_SO
 
 echo "Success: $BUILD_DIR/$TARGET_SO created."
-echo "Ready for deployment to Teradata via 'CREATE FUNCTION' or 'REPLACE FUNCTION'."
+echo "Copy it to the Teradata node and register it with scripts/register_udf.py (EXPORT_SO_PATH)."
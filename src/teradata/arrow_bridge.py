@@ -3,137 +3,596 @@
 Arrow Flight Bridge Service
 Receives data from Teradata C Table Operator via TCP and forwards to Trino via Arrow Flight.
 
+Protocol (all length prefixes are 4-byte big-endian):
+    - query ID
+    - schema frame, one of:
+        - an Arrow IPC schema message
+        - a column descriptor: u16 ncols, then per column u8 name_len, name, u8 type code
+        - JSON {"columns": [{"name": ..., "type": ...}]} from older producers
+    - batch frames: Arrow IPC record batch messages, or the legacy row-major format
+    - a zero length prefix ends the stream
+
 Usage:
     python3 arrow_bridge.py --listen-port 9999 --trino-host 127.0.0.1 --trino-port 50051
 """
 
+import asyncio
+import functools
+import os
 import socket
 import struct
 import threading
 import argparse
 import json
+import logging
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 import pyarrow as pa
 import pyarrow.flight as flight
 
+try:
+    from numba import njit
+except ImportError:  # Numba is optional; without it batches use the pure Python parser
+    njit = None
+
+# Column type codes, as sent in the column descriptor handshake
+TYPE_INTEGER = 0
+TYPE_BIGINT = 1
+TYPE_DOUBLE = 2
+TYPE_VARCHAR = 3
+
+# JSON handshake type names; anything else is forwarded as VARCHAR
+TYPE_CODES = {'INTEGER': TYPE_INTEGER, 'BIGINT': TYPE_BIGINT, 'DOUBLE': TYPE_DOUBLE, 'VARCHAR': TYPE_VARCHAR}
+
+ARROW_TYPES = {
+    TYPE_INTEGER: pa.int32(),
+    TYPE_BIGINT: pa.int64(),
+    TYPE_DOUBLE: pa.float64(),
+    TYPE_VARCHAR: pa.string(),
+}
+
+# Fixed-width column types: (big-endian wire dtype, native dtype, Arrow type)
+FIXED_WIDTH_TYPES = {
+    TYPE_INTEGER: ('>i4', np.int32, pa.int32()),
+    TYPE_BIGINT: ('>i8', np.int64, pa.int64()),
+    TYPE_DOUBLE: ('>f8', np.float64, pa.float64()),
+}
+
+# Batches buffered per connection between the socket reader and the Flight writer
+FORWARD_QUEUE_DEPTH = 4
+
+# Queued in place of the None end-of-stream sentinel when a connection fails,
+# so the forwarder stops without flushing the batches it is holding back
+_ABORT = object()
+
+# Precompiled big-endian readers for the Python fallback parser
+_UNPACK_I32 = struct.Struct('!i').unpack_from
+_UNPACK_I64 = struct.Struct('!q').unpack_from
+_UNPACK_F64 = struct.Struct('!d').unpack_from
+_UNPACK_U16 = struct.Struct('!H').unpack_from
+
+# Bytes requested per socket read when refilling a connection's read-ahead buffer
+READ_AHEAD_SIZE = 64 << 10
+
+logger = logging.getLogger('bridge')
+
+# Stack size for executor threads; decoding and Flight calls need far less than
+# the 8 MiB platform default
+EXECUTOR_STACK_SIZE = 256 << 10
+
+# Every encapsulated Arrow IPC message starts with this continuation marker
+IPC_CONTINUATION = b'\xff\xff\xff\xff'
+
+def _decode_rows(buf, num_rows, col_types, col_slots, valid, fixed4, fixed8, str_offsets, str_src):
+    """Walk a legacy row-major batch and scatter it into columnar NumPy outputs
+    
+    buf is the whole batch as uint8 (including the row count prefix). Each column
+    writes into row col_slots[col] of the output matching its type: fixed4/fixed8
+    are uint8 views over int32/int64 arrays and receive the big-endian value bytes
+    reversed (Arrow is little-endian). valid[col, row] is set to 1 for non-null cells.
+    
+    VARCHAR bytes are not copied here. str_offsets receives the Arrow offsets and
+    str_src[slot, row] the position of each cell's bytes in buf, so the exact size
+    of every string column is known before _copy_strings fills it.
+    
+    Returns False if the batch ends before num_rows rows were read.
+    """
+    size = buf.shape[0]
+    offset = 4
+    for row in range(num_rows):
+        for col in range(col_types.shape[0]):
+            if offset >= size:
+                return False
+            col_type = col_types[col]
+            slot = col_slots[col]
+            is_null = buf[offset]
+            offset += 1
+            
+            if is_null:
+                # Zero the value slot so no stale pool memory is sent for null cells
+                valid[col, row] = 0
+                if col_type == TYPE_INTEGER:
+                    for j in range(4):
+                        fixed4[slot, row * 4 + j] = 0
+                elif col_type == TYPE_VARCHAR:
+                    str_offsets[slot, row + 1] = str_offsets[slot, row]
+                else:
+                    for j in range(8):
+                        fixed8[slot, row * 8 + j] = 0
+                continue
+            
+            valid[col, row] = 1
+            if col_type == TYPE_INTEGER:
+                if offset + 4 > size:
+                    return False
+                for j in range(4):
+                    fixed4[slot, row * 4 + j] = buf[offset + 3 - j]
+                offset += 4
+            elif col_type == TYPE_BIGINT or col_type == TYPE_DOUBLE:
+                if offset + 8 > size:
+                    return False
+                for j in range(8):
+                    fixed8[slot, row * 8 + j] = buf[offset + 7 - j]
+                offset += 8
+            else:  # VARCHAR
+                if offset + 2 > size:
+                    return False
+                str_len = (np.int64(buf[offset]) << 8) | np.int64(buf[offset + 1])
+                offset += 2
+                if offset + str_len > size:
+                    return False
+                str_src[slot, row] = offset
+                str_offsets[slot, row + 1] = str_offsets[slot, row] + str_len
+                offset += str_len
+    return True
+
+
+def _copy_strings(buf, num_rows, str_offsets, str_src, str_values, str_bases):
+    """Copy VARCHAR bytes located by _decode_rows into one exactly sized buffer
+    
+    Column slot occupies str_values[str_bases[slot]:] and is filled in row order,
+    so every write is sequential and nothing is ever reallocated.
+    """
+    for slot in range(str_offsets.shape[0]):
+        base = str_bases[slot]
+        for row in range(num_rows):
+            start = str_offsets[slot, row]
+            end = str_offsets[slot, row + 1]
+            if end > start:
+                src = str_src[slot, row]
+                str_values[base + start:base + end] = buf[src:src + end - start]
+
+
+if njit is not None:
+    _decode_rows = njit(cache=True, nogil=True)(_decode_rows)
+    _copy_strings = njit(cache=True, nogil=True)(_copy_strings)
+else:
+    _decode_rows = None
+    _copy_strings = None
+
+
+_FALLBACK_READERS = {
+    TYPE_INTEGER: ('unpack_i32', 4),
+    TYPE_BIGINT: ('unpack_i64', 8),
+    TYPE_DOUBLE: ('unpack_f64', 8),
+}
+
+
+@functools.lru_cache(maxsize=256)
+def _build_row_decoder(col_types):
+    """Generate a Python row decoder specialized to one tuple of column type codes
+    
+    The column loop is unrolled into straight-line code per column, so the
+    decoder does no per-cell type dispatch. Decoders are cached per schema, so
+    the source is built and compiled once per column layout.
+    
+    The returned decode(data, offset, num_rows, col_valid, col_values, col_offsets)
+    fills the per-column outputs prepared by ArrowBridge._parse_batch and returns
+    the offset just past the last row. Slicing never fails, so a VARCHAR cut off
+    at the end of the batch shows up only as an offset beyond len(data).
+    """
+    lines = [
+        'def decode(data, offset, num_rows, col_valid, col_values, col_offsets,',
+        '           unpack_i32=_UNPACK_I32, unpack_i64=_UNPACK_I64,',
+        '           unpack_f64=_UNPACK_F64, unpack_u16=_UNPACK_U16):',
+    ]
+    for col_idx, col_type in enumerate(col_types):
+        lines.append(f'    valid{col_idx} = col_valid[{col_idx}]')
+        lines.append(f'    values{col_idx} = col_values[{col_idx}]')
+        if col_type not in _FALLBACK_READERS:
+            lines.append(f'    offsets{col_idx} = col_offsets[{col_idx}]')
+    
+    lines.append('    for row in range(num_rows):')
+    for col_idx, col_type in enumerate(col_types):
+        lines += [
+            '        if data[offset]:',
+            '            offset += 1',
+        ]
+        if col_type in _FALLBACK_READERS:
+            reader, width = _FALLBACK_READERS[col_type]
+            lines += [
+                '        else:',
+                f'            valid{col_idx}[row] = 1',
+                f'            values{col_idx}[row] = {reader}(data, offset + 1)[0]',
+                f'            offset += {width + 1}',
+            ]
+        else:  # VARCHAR
+            lines += [
+                f'            offsets{col_idx}[row + 1] = len(values{col_idx})',
+                '        else:',
+                f'            valid{col_idx}[row] = 1',
+                '            str_len = unpack_u16(data, offset + 1)[0]',
+                '            offset += 3',
+                f'            values{col_idx} += data[offset:offset + str_len]',
+                f'            offsets{col_idx}[row + 1] = len(values{col_idx})',
+                '            offset += str_len',
+            ]
+    if not col_types:
+        lines.append('        pass')
+    lines.append('    return offset')
+    
+    namespace = {
+        '_UNPACK_I32': _UNPACK_I32,
+        '_UNPACK_I64': _UNPACK_I64,
+        '_UNPACK_F64': _UNPACK_F64,
+        '_UNPACK_U16': _UNPACK_U16,
+    }
+    exec(compile('\n'.join(lines), '<row decoder>', 'exec'), namespace)
+    return namespace['decode']
+
+
+class SocketReader:
+    """Buffered reads from a non-blocking socket on the running event loop
+    
+    Reads ahead so that a length prefix, and often the whole frame behind it,
+    arrive in one recv call instead of one call per field. A read larger than
+    the read-ahead buffer is received straight into the caller's buffer once
+    the bytes already buffered are used up.
+    """
+    
+    def __init__(self, sock, read_ahead_size=READ_AHEAD_SIZE):
+        self.sock = sock
+        self._buf = memoryview(bytearray(read_ahead_size))
+        self._start = 0
+        self._end = 0
+        
+    async def read_exact(self, n):
+        """Receive exactly n bytes"""
+        data = bytearray(n)
+        await self.read_into(memoryview(data))
+        return data
+        
+    async def read_into(self, view):
+        """Fill a writable buffer, landing large reads directly in it"""
+        view = view.cast('B')
+        n = len(view)
+        got = min(n, self._end - self._start)
+        view[:got] = self._buf[self._start:self._start + got]
+        self._start += got
+        
+        loop = asyncio.get_running_loop()
+        while got < n:
+            if n - got >= len(self._buf):
+                r = await loop.sock_recv_into(self.sock, view[got:])
+                if not r:
+                    raise ConnectionError("Connection closed")
+                got += r
+            else:
+                r = await loop.sock_recv_into(self.sock, self._buf)
+                if not r:
+                    raise ConnectionError("Connection closed")
+                take = min(r, n - got)
+                view[got:got + take] = self._buf[:take]
+                self._start = take
+                self._end = r
+                got += take
+
+
 class ArrowBridge:
-    def __init__(self, listen_port, trino_host, trino_port):
+    def __init__(self, listen_port, trino_host, trino_port, socket_buffer_size=8 << 20,
+                 coalesce_rows=65536, small_query_rows=5000, max_workers=None):
         self.listen_port = listen_port
         self.trino_host = trino_host
         self.trino_port = trino_port
+        self.socket_buffer_size = socket_buffer_size
+        self.coalesce_rows = coalesce_rows
+        self.small_query_rows = small_query_rows
+        self.max_workers = max_workers or max(8, (os.cpu_count() or 1) * 2)
         self.running = True
+        # Decoded columns are allocated from one long-lived pool so freed batch
+        # buffers are recycled instead of going back to the system allocator
+        try:
+            self.memory_pool = pa.jemalloc_memory_pool()
+        except NotImplementedError:
+            self.memory_pool = pa.default_memory_pool()
+        # Per-thread decode scratch, reused across batches
+        self._scratch = threading.local()
+        # Flight clients shared by all connections, keyed by (host, port)
+        self._flight_clients = {}
+        self._flight_clients_lock = threading.Lock()
         
     def start(self):
         """Start the bridge server"""
+        self._warm_decoder()
+        # Decoding and Flight calls share one bounded pool, so a burst of UDF
+        # connections queues work instead of growing the thread count.
+        # The stack size applies to threads created after this call.
+        threading.stack_size(EXECUTOR_STACK_SIZE)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='bridge')
+        try:
+            asyncio.run(self._serve())
+        finally:
+            self.executor.shutdown(wait=False)
+            self._close_flight_clients()
+        
+    async def _serve(self):
+        """Accept connections and service all of them from one event loop"""
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # Set before listen() so the TCP window scale is negotiated for accepted sockets
+        self._tune_socket(server_socket)
         server_socket.bind(('0.0.0.0', self.listen_port))
         server_socket.listen(5)
-        print(f"Arrow Bridge listening on port {self.listen_port}", flush=True)
-        print(f"Will forward to Trino at {self.trino_host}:{self.trino_port}", flush=True)
+        server_socket.setblocking(False)
+        logger.info("Arrow Bridge listening on port %d", self.listen_port)
+        logger.info("Will forward to Trino at %s:%d", self.trino_host, self.trino_port)
         
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(self.executor)
+        clients = set()
         while self.running:
             try:
-                client_socket, addr = server_socket.accept()
-                print(f"Connection from {addr}", flush=True)
-                thread = threading.Thread(target=self.handle_client, args=(client_socket, addr))
-                thread.daemon = True
-                thread.start()
+                client_socket, addr = await loop.sock_accept(server_socket)
+                logger.debug("Connection from %s", addr)
+                # Hold a reference so the task is not garbage collected mid-stream
+                task = loop.create_task(self.handle_client(client_socket, addr))
+                clients.add(task)
+                task.add_done_callback(clients.discard)
             except Exception as e:
-                print(f"Error accepting connection: {e}", flush=True)
+                logger.error("Error accepting connection: %s", e)
                 
-    def handle_client(self, client_socket, addr):
-        """Handle data from C table operator and forward to Trino"""
+    async def handle_client(self, client_socket, addr):
+        """Handle data from C table operator and forward to Trino
+        
+        Socket reads run on the event loop, while batch decoding and the blocking
+        Flight calls run in the default executor. A bounded queue sits between
+        receiving and forwarding so the socket keeps draining during a slow write.
+        
+        pyarrow cannot cancel a DoPut: the writer can only be closed, which ends
+        the upload normally. When a connection fails, batches not yet written are
+        dropped, but those already forwarded reach Trino as a complete upload.
+        """
+        loop = asyncio.get_running_loop()
+        query_id = None
         writer = None
-        client = None
+        completed = False
+        queue = asyncio.Queue(maxsize=FORWARD_QUEUE_DEPTH)
+        forward = None
         try:
-            # Read query ID
-            query_id_len_data = self._recv_exact(client_socket, 4)
-            query_id_len = struct.unpack('!I', query_id_len_data)[0]
-            query_id = self._recv_exact(client_socket, query_id_len).decode('utf-8')
-            print(f"Query ID: {query_id}", flush=True)
+            client_socket.setblocking(False)
+            self._tune_socket(client_socket)
+            reader = SocketReader(client_socket)
             
-            # Read schema (as JSON)
-            schema_len_data = self._recv_exact(client_socket, 4)
-            schema_len = struct.unpack('!I', schema_len_data)[0]
-            schema_json = self._recv_exact(client_socket, schema_len).decode('utf-8')
-            schema_info = json.loads(schema_json)
-            print(f"Schema: {schema_info}", flush=True)
-            
-            # Build Arrow schema
-            fields = []
-            for col in schema_info['columns']:
-                if col['type'] == 'INTEGER':
-                    fields.append(pa.field(col['name'], pa.int32()))
-                elif col['type'] == 'BIGINT':
-                    fields.append(pa.field(col['name'], pa.int64()))
-                elif col['type'] == 'VARCHAR':
-                    fields.append(pa.field(col['name'], pa.string()))
-                elif col['type'] == 'DOUBLE':
-                    fields.append(pa.field(col['name'], pa.float64()))
-                else:
-                    fields.append(pa.field(col['name'], pa.string()))
-            schema = pa.schema(fields)
+            # Read query ID
+            query_id_len_data = await reader.read_exact(4)
+            query_id_len = int.from_bytes(query_id_len_data, 'big')
+            query_id = (await reader.read_exact(query_id_len)).decode('utf-8')
+            logger.debug("Query ID: %s", query_id)
             
-            # Connect to Trino Flight server
-            location = flight.Location.for_grpc_tcp(self.trino_host, self.trino_port)
-            client = flight.FlightClient(location)
+            # Read schema
+            schema_len_data = await reader.read_exact(4)
+            schema_len = int.from_bytes(schema_len_data, 'big')
+            schema_data = await reader.read_exact(schema_len)
+            schema, col_types = self._read_schema(schema_data)
+            logger.debug("Schema: %s", schema)
             
-            # Start DoPut stream
+            # Start DoPut stream on the shared Trino Flight client
+            client = self.get_flight_client(self.trino_host, self.trino_port)
             descriptor = flight.FlightDescriptor.for_path(query_id)
-            writer, _ = client.do_put(descriptor, schema)
+            writer, _ = await loop.run_in_executor(None, client.do_put, descriptor, schema)
+            forward = loop.create_task(self._forward_batches(queue, writer))
             
-            total_rows = 0
-            batch_count = 0
+            # Receive buffer for legacy batches, reused across batches and grown on demand
+            batch_buf = bytearray()
             
-            # Receive and forward batches
+            # Receive batches and hand them to the forwarder
             while True:
                 # Read batch length
-                batch_len_data = self._recv_exact(client_socket, 4)
-                batch_len = struct.unpack('!I', batch_len_data)[0]
+                batch_len_data = await reader.read_exact(4)
+                batch_len = int.from_bytes(batch_len_data, 'big')
                 
                 if batch_len == 0:
                     break
                     
-                # Read batch data
-                batch_data = self._recv_exact(client_socket, batch_len)
-                
-                # Parse rows and create Arrow batch
-                arrays = self._parse_batch(batch_data, schema_info['columns'])
-                batch = pa.record_batch(arrays, schema=schema)
+                # IPC batches are forwarded as-is; legacy batches are parsed into Arrow.
+                # IPC messages land directly in a pool buffer that the batch then
+                # aliases, so only legacy batches share a receive buffer.
+                if col_types is None:
+                    batch_data = pa.allocate_buffer(batch_len, memory_pool=self.memory_pool)
+                    await reader.read_into(memoryview(batch_data))
+                    batch = pa.ipc.read_record_batch(batch_data, schema)
+                else:
+                    if len(batch_buf) < batch_len:
+                        batch_buf = bytearray(batch_len)
+                    batch_data = memoryview(batch_buf)[:batch_len]
+                    await reader.read_into(batch_data)
+                    batch = await loop.run_in_executor(None, self._decode_batch, batch_data, col_types, schema)
                 
-                writer.write_batch(batch)
-                total_rows += batch.num_rows
-                batch_count += 1
+                await self._enqueue(queue, batch, forward)
                 
-            writer.close()
-            client_socket.sendall(b'OK')
-            print(f"Successfully forwarded {total_rows} rows to Trino in {batch_count} batches", flush=True)
+            await self._enqueue(queue, None, forward)
+            total_rows, batch_count = await forward
+            await loop.run_in_executor(None, writer.close)
+            completed = True
+            await loop.sock_sendall(client_socket, b'OK')
+            logger.info("Successfully forwarded %d rows to Trino in %d batches for query %s",
+                        total_rows, batch_count, query_id)
             
         except Exception as e:
-            print(f"Error handling client {addr}: {e}", flush=True)
+            logger.error("Error handling client %s: %s", addr, e)
         finally:
-            if writer:
-                try: writer.close()
+            sent_rows = 0
+            if forward:
+                if not forward.done():
+                    # Drop unsent batches and let an in-flight write finish before closing
+                    while not queue.empty():
+                        queue.get_nowait()
+                    queue.put_nowait(_ABORT)
+                try: sent_rows, _ = await forward
                 except: pass
-            if client:
-                try: client.close()
+            if writer and not completed:
+                if sent_rows:
+                    logger.warning("Query %s failed after %d rows were forwarded; "
+                                   "Trino received them as a complete upload", query_id, sent_rows)
+                try: await loop.run_in_executor(None, writer.close)
                 except: pass
             client_socket.close()
             
-    def _recv_exact(self, sock, n):
-        """Receive exactly n bytes from socket"""
-        data = b''
-        while len(data) < n:
-            chunk = sock.recv(n - len(data))
-            if not chunk:
-                raise ConnectionError("Connection closed")
-            data += chunk
-        return data
+    def get_flight_client(self, host, port):
+        """Return the shared Flight client for host:port, creating it on first use
         
-    def _parse_batch(self, data, columns):
+        gRPC multiplexes concurrent DoPut streams over the client's one HTTP/2
+        channel, so queries skip the connection (and TLS) handshake. Keepalive
+        pings stop idle channels between queries from being dropped silently.
+        """
+        key = (host, port)
+        with self._flight_clients_lock:
+            client = self._flight_clients.get(key)
+            if client is None:
+                location = flight.Location.for_grpc_tcp(host, port)
+                client = flight.FlightClient(location, generic_options=[
+                    ('grpc.keepalive_time_ms', 30000),
+                    ('grpc.http2.min_time_between_pings_ms', 10000),
+                ])
+                self._flight_clients[key] = client
+            return client
+            
+    def _close_flight_clients(self):
+        with self._flight_clients_lock:
+            clients = list(self._flight_clients.values())
+            self._flight_clients.clear()
+        for client in clients:
+            try: client.close()
+            except: pass
+            
+    async def _forward_batches(self, queue, writer):
+        """Write queued batches to the Flight stream until the None sentinel
+        
+        Small source batches are held back and combined until coalesce_rows rows
+        are pending, so Trino receives fewer, larger Flight messages. The first
+        message also waits for small_query_rows, so a query that ends below
+        max(coalesce_rows, small_query_rows) is sent as one message at end of
+        stream. With the defaults coalesce_rows is the larger of the two.
+        
+        On _ABORT the forwarder returns at once and batches still held back for
+        coalescing are discarded rather than written.
+        
+        Returns (total_rows, batch_count), counting the Flight messages written.
+        """
+        loop = asyncio.get_running_loop()
+        total_rows = 0
+        batch_count = 0
+        pending = []
+        pending_rows = 0
+        while True:
+            batch = await queue.get()
+            if batch is _ABORT:
+                return total_rows, batch_count
+            if batch is not None and batch.num_rows:
+                pending.append(batch)
+                pending_rows += batch.num_rows
+            flush_rows = self.coalesce_rows if batch_count else max(self.coalesce_rows, self.small_query_rows)
+            if pending and (batch is None or pending_rows >= flush_rows):
+                combined = pending[0]
+                if len(pending) > 1:
+                    combined = await loop.run_in_executor(None, self._combine_batches, pending)
+                await loop.run_in_executor(None, writer.write_batch, combined)
+                batch_count += 1
+                total_rows += pending_rows
+                pending = []
+                pending_rows = 0
+            if batch is None:
+                return total_rows, batch_count
+                
+    def _combine_batches(self, batches):
+        """Concatenate record batches into a single contiguous batch"""
+        table = pa.Table.from_batches(batches).combine_chunks(memory_pool=self.memory_pool)
+        return table.to_batches()[0]
+            
+    async def _enqueue(self, queue, item, forward):
+        """Queue an item for the forwarder, re-raising its error if it has failed"""
+        if not forward.done():
+            if not queue.full():
+                queue.put_nowait(item)
+                return
+            put = asyncio.ensure_future(queue.put(item))
+            await asyncio.wait({put, forward}, return_when=asyncio.FIRST_COMPLETED)
+            if put.done():
+                return
+            put.cancel()
+        forward.result()
+        
+    def _decode_batch(self, data, col_types, schema):
+        """Parse a legacy row-major batch into a record batch (runs in the executor)"""
+        return pa.record_batch(self._parse_batch(data, col_types), schema=schema)
+        
+    def _tune_socket(self, sock):
+        """Disable Nagle and size kernel buffers so a full batch fits between recv calls"""
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.socket_buffer_size)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.socket_buffer_size)
+        
+    def _read_schema(self, data):
+        """Build the Arrow schema from the handshake frame
+        
+        Returns (schema, col_types). IPC producers send a serialized Arrow schema
+        message and col_types is None. Otherwise col_types is a uint8 array of
+        per-column type codes, resolved once here so batch decoding never looks
+        at type names.
+        """
+        if data[:4] == IPC_CONTINUATION:
+            return pa.ipc.read_schema(pa.py_buffer(data)), None
+        
+        # Older producers may pad the JSON with whitespace. A descriptor never starts
+        # with a whitespace byte, which would mean thousands of columns.
+        if data.lstrip()[:1] == b'{':
+            schema_info = json.loads(data.decode('utf-8'))
+            names = [col['name'] for col in schema_info['columns']]
+            codes = [TYPE_CODES.get(col['type'], TYPE_VARCHAR) for col in schema_info['columns']]
+        else:
+            names, codes = self._read_column_descriptor(data)
+        
+        schema = pa.schema([pa.field(name, ARROW_TYPES[code]) for name, code in zip(names, codes)])
+        return schema, np.array(codes, dtype=np.uint8)
+        
+    def _read_column_descriptor(self, data):
+        """Parse the compact handshake: u16 ncols, then per column u8 name_len, name, u8 type code"""
+        if len(data) < 2:
+            raise ValueError(f"Truncated column descriptor: {len(data)} bytes")
+        num_cols = int.from_bytes(data[:2], 'big')
+        offset = 2
+        names = []
+        codes = []
+        for col_idx in range(num_cols):
+            # Each column needs its length byte, the name and the type code
+            if offset >= len(data) or offset + data[offset] + 2 > len(data):
+                raise ValueError(f"Truncated column descriptor: expected {num_cols} columns, "
+                                 f"got {col_idx} in {len(data)} bytes")
+            name_len = data[offset]
+            offset += 1
+            names.append(bytes(data[offset:offset+name_len]).decode('utf-8'))
+            offset += name_len
+            code = data[offset]
+            offset += 1
+            if code not in ARROW_TYPES:
+                raise ValueError(f"Unknown column type code {code} for column {names[-1]}")
+            codes.append(code)
+        return names, codes
+        
+    def _parse_batch(self, data, col_types):
         """Parse batch data into Arrow arrays
         
         Format:
@@ -143,67 +602,235 @@ class ArrowBridge:
             - If not null:
                 - INTEGER: 4 bytes big-endian
                 - BIGINT: 8 bytes big-endian
+                - DOUBLE: 8 bytes big-endian
                 - VARCHAR: 2 bytes length + data
         """
         offset = 0
-        num_rows = struct.unpack('!I', data[offset:offset+4])[0]
+        num_rows = int.from_bytes(data[offset:offset+4], 'big')
         offset += 4
         
-        print(f"Parsing batch: {num_rows} rows, {len(columns)} columns", flush=True)
+        logger.debug("Parsing batch: %d rows, %d columns", num_rows, len(col_types))
         
-        # Initialize lists for each column
-        col_data = [[] for _ in columns]
+        # Vectorized path for INTEGER/BIGINT/DOUBLE-only batches
+        if all(col_type in FIXED_WIDTH_TYPES for col_type in col_types):
+            arrays = self._parse_fixed_width_batch(data, col_types, num_rows)
+            if arrays is not None:
+                return arrays
         
-        for row_idx in range(num_rows):
-            for col_idx, col in enumerate(columns):
-                # Read null indicator
-                is_null = data[offset]
-                offset += 1
-                
-                if is_null:
-                    col_data[col_idx].append(None)
-                else:
-                    if col['type'] == 'INTEGER':
-                        val = struct.unpack('!i', data[offset:offset+4])[0]
-                        offset += 4
-                        col_data[col_idx].append(val)
-                    elif col['type'] == 'BIGINT':
-                        val = struct.unpack('!q', data[offset:offset+8])[0]
-                        offset += 8
-                        col_data[col_idx].append(val)
-                    elif col['type'] == 'DOUBLE':
-                        val = struct.unpack('!d', data[offset:offset+8])[0]
-                        offset += 8
-                        col_data[col_idx].append(val)
-                    else:  # VARCHAR
-                        str_len = struct.unpack('!H', data[offset:offset+2])[0]
-                        offset += 2
-                        val = data[offset:offset+str_len].decode('utf-8', errors='replace')
-                        offset += str_len
-                        col_data[col_idx].append(val)
-        
-        # Convert to Arrow arrays
+        if _decode_rows is not None:
+            return self._parse_compiled_batch(data, col_types, num_rows)
+        
+        # Plain ints compare faster than the NumPy scalars in col_types
+        col_types = col_types.tolist()
+        
+        # Preallocate every column and fill it by row index: fixed-width values go
+        # straight into pool buffers, strings into one bytearray plus offsets
+        col_valid = [bytearray(num_rows) for _ in col_types]
+        col_buffers = []
+        col_values = []
+        col_offsets = []
+        for col_type in col_types:
+            if col_type in FIXED_WIDTH_TYPES:
+                values_buf, values = self._allocate_array(num_rows, FIXED_WIDTH_TYPES[col_type][1])
+                values.fill(0)
+                col_buffers.append(values_buf)
+                col_values.append(values)
+                col_offsets.append(None)
+            else:
+                offsets_buf, offsets = self._allocate_array(num_rows + 1, np.int32)
+                offsets[0] = 0
+                col_buffers.append(offsets_buf)
+                col_values.append(bytearray())
+                col_offsets.append(offsets)
+        
+        decode_rows = _build_row_decoder(tuple(col_types))
+        if decode_rows(data, offset, num_rows, col_valid, col_values, col_offsets) > len(data):
+            raise ValueError(f"Truncated batch: expected {num_rows} rows in {len(data)} bytes")
+        
+        # Wrap the filled buffers as Arrow arrays
         arrays = []
-        for col_idx, col in enumerate(columns):
-            if col['type'] == 'INTEGER':
-                arrays.append(pa.array(col_data[col_idx], type=pa.int32()))
-            elif col['type'] == 'BIGINT':
-                arrays.append(pa.array(col_data[col_idx], type=pa.int64()))
-            elif col['type'] == 'DOUBLE':
-                arrays.append(pa.array(col_data[col_idx], type=pa.float64()))
+        for col_idx, col_type in enumerate(col_types):
+            validity, null_count = self._validity_bitmap(np.frombuffer(col_valid[col_idx], dtype=np.uint8))
+            if col_type == TYPE_VARCHAR:
+                array = self._string_array(
+                    num_rows, col_buffers[col_idx], pa.py_buffer(col_values[col_idx]), validity, null_count)
             else:
-                arrays.append(pa.array(col_data[col_idx], type=pa.string()))
+                array = pa.Array.from_buffers(
+                    ARROW_TYPES[col_type], num_rows, [validity, col_buffers[col_idx]], null_count=null_count)
+            arrays.append(array)
                 
         return arrays
+        
+    def _validity_bitmap(self, valid):
+        """Pack per-row validity flags into an Arrow bitmap, returning (bitmap, null_count)
+        
+        valid holds one nonzero entry per non-null row, taken straight from the
+        wire null bytes. A column with no nulls gets no bitmap at all.
+        """
+        null_count = len(valid) - int(np.count_nonzero(valid))
+        if not null_count:
+            return None, 0
+        return pa.py_buffer(np.packbits(valid, bitorder='little')), null_count
+        
+    def _string_array(self, num_rows, offsets, values, validity, null_count):
+        """Wrap raw wire bytes as an Arrow string array without decoding them
+        
+        VARCHAR bytes are already UTF-8, so valid columns never become Python str
+        objects. Only a column that fails validation is rebuilt, cell by cell.
+        """
+        array = pa.StringArray.from_buffers(num_rows, offsets, values, validity, null_count)
+        try:
+            array.validate(full=True)
+        except pa.ArrowInvalid:
+            return self._replace_invalid_utf8(array)
+        return array
+        
+    def _replace_invalid_utf8(self, array):
+        """Rebuild a string array whose bytes are not valid UTF-8, substituting U+FFFD"""
+        values = [
+            None if value is None else value.decode('utf-8', errors='replace')
+            for value in array.view(pa.binary()).to_pylist()
+        ]
+        return pa.array(values, type=pa.string(), memory_pool=self.memory_pool)
+        
+    def _parse_compiled_batch(self, data, col_types, num_rows):
+        """Decode a batch with the Numba-compiled row decoder"""
+        # Each column gets a row in the output array for its width class
+        col_slots = np.zeros(len(col_types), dtype=np.int64)
+        counts = {4: 0, 8: 0, 0: 0}
+        for col_idx, col_type in enumerate(col_types):
+            width = 4 if col_type == TYPE_INTEGER else 8 if col_type != TYPE_VARCHAR else 0
+            col_slots[col_idx] = counts[width]
+            counts[width] += 1
+        
+        valid = self._scratch_array('valid', (len(col_types), num_rows), np.uint8)
+        fixed4_buf, fixed4 = self._allocate_array((counts[4], num_rows), np.int32)
+        fixed8_buf, fixed8 = self._allocate_array((counts[8], num_rows), np.int64)
+        str_offsets_buf, str_offsets = self._allocate_array((counts[0], num_rows + 1), np.int32)
+        str_offsets[:, 0] = 0
+        str_src = self._scratch_array('str_src', (counts[0], num_rows), np.int64)
+        
+        buf = np.frombuffer(data, dtype=np.uint8)
+        ok = _decode_rows(
+            buf, num_rows, col_types, col_slots, valid,
+            fixed4.view(np.uint8), fixed8.view(np.uint8), str_offsets, str_src)
+        if not ok:
+            raise ValueError(f"Truncated batch: expected {num_rows} rows in {len(data)} bytes")
+        
+        # The first pass produced final offsets, so string bytes go straight into
+        # one pool buffer of exactly the right size, one region per column
+        str_sizes = str_offsets[:, num_rows].astype(np.int64)
+        str_bases = np.zeros(counts[0], dtype=np.int64)
+        np.cumsum(str_sizes[:-1], out=str_bases[1:])
+        str_values_buf, str_values = self._allocate_array(int(str_sizes.sum()), np.uint8)
+        if counts[0]:
+            _copy_strings(buf, num_rows, str_offsets, str_src, str_values, str_bases)
+        
+        arrays = []
+        for col_idx, col_type in enumerate(col_types):
+            slot = col_slots[col_idx]
+            validity, null_count = self._validity_bitmap(valid[col_idx])
+            if col_type == TYPE_VARCHAR:
+                offsets = str_offsets_buf.slice(slot * (num_rows + 1) * 4, (num_rows + 1) * 4)
+                values = str_values_buf.slice(int(str_bases[slot]), int(str_sizes[slot]))
+                array = self._string_array(num_rows, offsets, values, validity, null_count)
+            elif col_type == TYPE_INTEGER:
+                values = fixed4_buf.slice(slot * num_rows * 4, num_rows * 4)
+                array = pa.Array.from_buffers(pa.int32(), num_rows, [validity, values], null_count=null_count)
+            else:
+                values = fixed8_buf.slice(slot * num_rows * 8, num_rows * 8)
+                array = pa.Array.from_buffers(
+                    ARROW_TYPES[col_type], num_rows, [validity, values], null_count=null_count)
+            arrays.append(array)
+        return arrays
+        
+    def _allocate_array(self, shape, dtype):
+        """Allocate an uninitialized NumPy array backed by an Arrow buffer from the bridge pool
+        
+        Returns (buffer, array). Arrow arrays are built from the buffer (or slices
+        of it), so decoded values are written once and never copied again.
+        """
+        dtype = np.dtype(dtype)
+        buf = pa.allocate_buffer(int(np.prod(shape)) * dtype.itemsize, memory_pool=self.memory_pool)
+        return buf, np.frombuffer(buf, dtype=dtype).reshape(shape)
+        
+    def _scratch_array(self, name, shape, dtype):
+        """Return a per-thread scratch array, reallocated only when a batch outgrows it
+        
+        Only for intermediates: the contents are overwritten by the next batch
+        decoded on the same thread, so nothing sent to Trino may alias them.
+        """
+        size = int(np.prod(shape))
+        scratch = getattr(self._scratch, name, None)
+        if scratch is None or scratch.shape[0] < size:
+            scratch = np.empty(size, dtype=dtype)
+            setattr(self._scratch, name, scratch)
+        return scratch[:size].reshape(shape)
+        
+    def _warm_decoder(self):
+        """Compile the row decoder up front so the first real batch is not slow"""
+        if _decode_rows is None:
+            return
+        col_types = np.array([TYPE_INTEGER, TYPE_BIGINT, TYPE_DOUBLE, TYPE_VARCHAR], dtype=np.uint8)
+        row = b'\x00' + bytes(4) + b'\x00' + bytes(8) + b'\x00' + bytes(8) + b'\x00\x00\x01a'
+        # Pass a writable memoryview like handle_client does: Numba compiles a
+        # separate signature for read-only buffers such as bytes
+        data = memoryview(bytearray(struct.pack('!I', 1) + row))
+        self._parse_compiled_batch(data, col_types, 1)
+        
+    def _parse_fixed_width_batch(self, data, col_types, num_rows):
+        """Decode a batch of fixed-width columns with NumPy instead of per-cell unpacking
+        
+        Null cells carry no value bytes, so rows only sit on a fixed stride when the
+        batch contains no nulls. Returns None when the batch size does not match that
+        stride and the caller must fall back to the row-by-row parser.
+        """
+        row_dtype = np.dtype([
+            (f'c{col_idx}', [('null', 'u1'), ('v', FIXED_WIDTH_TYPES[col_type][0])])
+            for col_idx, col_type in enumerate(col_types)
+        ])
+        if len(data) - 4 != num_rows * row_dtype.itemsize:
+            return None
+        
+        rows = np.frombuffer(data, dtype=row_dtype, count=num_rows, offset=4)
+        
+        arrays = []
+        for col_idx, col_type in enumerate(col_types):
+            _, native_dtype, arrow_type = FIXED_WIDTH_TYPES[col_type]
+            cells = rows[f'c{col_idx}']
+            # Assignment byteswaps into a native-order buffer from the bridge pool
+            values_buf, values = self._allocate_array(num_rows, native_dtype)
+            values[:] = cells['v']
+            validity, null_count = self._validity_bitmap(cells['null'] == 0)
+            arrays.append(pa.Array.from_buffers(
+                arrow_type, num_rows, [validity, values_buf], null_count=null_count))
+        return arrays
 
 def main():
     parser = argparse.ArgumentParser(description='Arrow Flight Bridge Service')
     parser.add_argument('--listen-port', type=int, default=9999, help='Port to listen on')
     parser.add_argument('--trino-host', default='127.0.0.1', help='Trino Flight server host')
     parser.add_argument('--trino-port', type=int, default=50051, help='Trino Flight server port')
+    parser.add_argument('--socket-buffer-size', type=int, default=8 << 20,
+                        help='SO_RCVBUF/SO_SNDBUF size in bytes for bridge sockets')
+    parser.add_argument('--flight-coalesce-rows', type=int, default=65536,
+                        help='Combine incoming batches until this many rows before each Flight write (0 disables)')
+    parser.add_argument('--small-query-rows', type=int, default=5000,
+                        help='Hold the first Flight write until this many rows; only has an effect '
+                             'above --flight-coalesce-rows, which already holds back smaller queries')
+    parser.add_argument('--max-workers', type=int, default=None,
+                        help='Threads for decoding and Flight calls (default: max(8, 2 x CPU count))')
+    parser.add_argument('--log-level', default='INFO',
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], help='Bridge log level')
     args = parser.parse_args()
     
-    bridge = ArrowBridge(args.listen_port, args.trino_host, args.trino_port)
+    logging.basicConfig(level=args.log_level, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    
+    bridge = ArrowBridge(args.listen_port, args.trino_host, args.trino_port,
+                         socket_buffer_size=args.socket_buffer_size,
+                         coalesce_rows=args.flight_coalesce_rows,
+                         small_query_rows=args.small_query_rows,
+                         max_workers=args.max_workers)
     bridge.start()
 
 if __name__ == '__main__':
@@ -0,0 +1,338 @@
+"""Tests for the Arrow Flight bridge (src/teradata/arrow_bridge.py)
+
+The decoder tests compare every decode path against a reference parser that
+follows the legacy wire format cell by cell, the way the original bridge did.
+The end-to-end tests run the bridge against an in-process Flight server.
+
+Run with: python -m unittest discover tests
+"""
+import json
+import logging
+import os
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+import pyarrow as pa
+import pyarrow.flight as flight
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'teradata'))
+import arrow_bridge  # noqa: E402
+
+TYPE_NAMES = ['INTEGER', 'BIGINT', 'DOUBLE', 'VARCHAR']
+
+VARCHAR_SAMPLES = [b'', b'a', b'teradata', 'café'.encode(), '\U0001f600 emoji'.encode(),
+                   b'x' * 300, b'\xff\xfe', b'ok\xc3']
+
+
+def _random_batch(rng, type_names, num_rows, null_fraction):
+    """Random rows for a schema; VARCHAR values are bytes and may be invalid UTF-8"""
+    rows = []
+    for _ in range(num_rows):
+        row = []
+        for type_name in type_names:
+            if rng.random() < null_fraction:
+                row.append(None)
+            elif type_name == 'INTEGER':
+                row.append(rng.randint(-2**31, 2**31 - 1))
+            elif type_name == 'BIGINT':
+                row.append(rng.randint(-2**63, 2**63 - 1))
+            elif type_name == 'DOUBLE':
+                row.append(rng.uniform(-1e12, 1e12))
+            else:
+                row.append(rng.choice(VARCHAR_SAMPLES))
+        rows.append(row)
+    return rows
+
+
+def _encode_batch(type_names, rows):
+    """Encode rows in the legacy row-major batch format"""
+    out = bytearray(struct.pack('!I', len(rows)))
+    for row in rows:
+        for type_name, value in zip(type_names, row):
+            if value is None:
+                out.append(1)
+                continue
+            out.append(0)
+            if type_name == 'INTEGER':
+                out += struct.pack('!i', value)
+            elif type_name == 'BIGINT':
+                out += struct.pack('!q', value)
+            elif type_name == 'DOUBLE':
+                out += struct.pack('!d', value)
+            else:
+                out += struct.pack('!H', len(value)) + value
+    return bytes(out)
+
+
+def _reference_parse(data, type_names):
+    """Decode a legacy batch one cell at a time into Python lists"""
+    offset = 0
+    num_rows = struct.unpack('!I', data[offset:offset+4])[0]
+    offset += 4
+    col_data = [[] for _ in type_names]
+    for _ in range(num_rows):
+        for col_idx, type_name in enumerate(type_names):
+            is_null = data[offset]
+            offset += 1
+            if is_null:
+                col_data[col_idx].append(None)
+            elif type_name == 'INTEGER':
+                col_data[col_idx].append(struct.unpack('!i', data[offset:offset+4])[0])
+                offset += 4
+            elif type_name == 'BIGINT':
+                col_data[col_idx].append(struct.unpack('!q', data[offset:offset+8])[0])
+                offset += 8
+            elif type_name == 'DOUBLE':
+                col_data[col_idx].append(struct.unpack('!d', data[offset:offset+8])[0])
+                offset += 8
+            else:
+                str_len = struct.unpack('!H', data[offset:offset+2])[0]
+                offset += 2
+                col_data[col_idx].append(data[offset:offset+str_len].decode('utf-8', errors='replace'))
+                offset += str_len
+    return col_data
+
+
+def _json_schema(type_names):
+    columns = [{'name': f'col_{i}', 'type': t} for i, t in enumerate(type_names)]
+    return json.dumps({'columns': columns}).encode('utf-8')
+
+
+def _descriptor_schema(type_names):
+    out = bytearray(struct.pack('!H', len(type_names)))
+    for i, type_name in enumerate(type_names):
+        name = f'col_{i}'.encode('utf-8')
+        out += bytes([len(name)]) + name + bytes([arrow_bridge.TYPE_CODES[type_name]])
+    return bytes(out)
+
+
+class DecoderTest(unittest.TestCase):
+    def setUp(self):
+        self.bridge = arrow_bridge.ArrowBridge(0, '127.0.0.1', 0)
+
+    def _col_types(self, type_names):
+        return self.bridge._read_schema(_json_schema(type_names))[1]
+
+    def _decode_paths(self, data, col_types, num_rows):
+        """Yield (name, arrays) for every decode path that accepts this batch"""
+        fixed = None
+        if all(col_type in arrow_bridge.FIXED_WIDTH_TYPES for col_type in col_types):
+            fixed = self.bridge._parse_fixed_width_batch(data, col_types, num_rows)
+        if fixed is not None:
+            yield 'numpy', fixed
+        if arrow_bridge._decode_rows is not None:
+            yield 'numba', self.bridge._parse_compiled_batch(data, col_types, num_rows)
+        with mock.patch.object(arrow_bridge, '_decode_rows', None), \
+                mock.patch.object(self.bridge, '_parse_fixed_width_batch', return_value=None):
+            yield 'python', self.bridge._parse_batch(data, col_types)
+
+    def test_decoders_match_reference(self):
+        rng = random.Random(1234)
+        for _ in range(300):
+            type_names = [rng.choice(TYPE_NAMES) for _ in range(rng.randint(1, 5))]
+            num_rows = rng.choice([0, 1, 7, rng.randint(2, 200)])
+            null_fraction = rng.choice([0.0, 0.0, 0.1, 0.5, 1.0])
+            data = _encode_batch(type_names, _random_batch(rng, type_names, num_rows, null_fraction))
+            expected = _reference_parse(data, type_names)
+            col_types = self._col_types(type_names)
+            # Real batches arrive as writable slices of the receive buffer
+            view = memoryview(bytearray(data))
+            for path, arrays in self._decode_paths(view, col_types, num_rows):
+                self.assertEqual(len(arrays), len(type_names))
+                for array, type_name, values in zip(arrays, type_names, expected):
+                    array.validate(full=True)
+                    self.assertEqual(array.type, arrow_bridge.ARROW_TYPES[arrow_bridge.TYPE_CODES[type_name]])
+                    self.assertEqual(array.to_pylist(), values, f'{path} decoder, {type_names}')
+
+    def test_fixed_width_path_declines_batches_with_nulls(self):
+        type_names = ['INTEGER', 'DOUBLE']
+        data = _encode_batch(type_names, [[1, None], [2, 3.5]])
+        self.assertIsNone(self.bridge._parse_fixed_width_batch(data, self._col_types(type_names), 2))
+
+    def test_truncated_batch_raises(self):
+        type_names = ['INTEGER', 'VARCHAR']
+        data = _encode_batch(type_names, [[1, b'abc'], [2, b'def']])
+        col_types = self._col_types(type_names)
+        for cut in range(5, len(data)):
+            with self.assertRaises((ValueError, IndexError, struct.error)):
+                self.bridge._parse_batch(memoryview(bytearray(data[:cut])), col_types)
+        if arrow_bridge._decode_rows is not None:
+            with self.assertRaises(ValueError):
+                self.bridge._parse_compiled_batch(data[:-1], col_types, 2)
+
+
+class SchemaTest(unittest.TestCase):
+    def setUp(self):
+        self.bridge = arrow_bridge.ArrowBridge(0, '127.0.0.1', 0)
+
+    def test_json_schema(self):
+        schema, col_types = self.bridge._read_schema(_json_schema(['INTEGER', 'VARCHAR', 'DATE']))
+        self.assertEqual(schema.types, [pa.int32(), pa.string(), pa.string()])
+        self.assertEqual(col_types.tolist(), [arrow_bridge.TYPE_INTEGER, arrow_bridge.TYPE_VARCHAR,
+                                              arrow_bridge.TYPE_VARCHAR])
+
+    def test_json_schema_with_leading_whitespace(self):
+        schema, _ = self.bridge._read_schema(b'\n  ' + _json_schema(['BIGINT']) + b'\n')
+        self.assertEqual(schema.names, ['col_0'])
+        self.assertEqual(schema.types, [pa.int64()])
+
+    def test_column_descriptor_matches_json(self):
+        type_names = ['INTEGER', 'BIGINT', 'DOUBLE', 'VARCHAR']
+        from_json = self.bridge._read_schema(_json_schema(type_names))
+        from_descriptor = self.bridge._read_schema(_descriptor_schema(type_names))
+        self.assertTrue(from_json[0].equals(from_descriptor[0]))
+        self.assertEqual(from_json[1].tolist(), from_descriptor[1].tolist())
+
+    def test_truncated_column_descriptor(self):
+        data = _descriptor_schema(['INTEGER', 'VARCHAR'])
+        for cut in range(len(data)):
+            with self.assertRaises(ValueError):
+                self.bridge._read_schema(data[:cut])
+
+    def test_unknown_type_code(self):
+        with self.assertRaises(ValueError):
+            self.bridge._read_schema(struct.pack('!H', 1) + b'\x01a\x09')
+
+    def test_ipc_schema(self):
+        schema = pa.schema([('a', pa.int32()), ('b', pa.string())])
+        parsed, col_types = self.bridge._read_schema(schema.serialize().to_pybytes())
+        self.assertTrue(parsed.equals(schema))
+        self.assertIsNone(col_types)
+
+
+class RecordingFlightServer(flight.FlightServerBase):
+    """Flight server that keeps every upload, keyed by query ID"""
+
+    def __init__(self, location):
+        super().__init__(location)
+        self.uploads = {}
+
+    def do_put(self, context, descriptor, reader, writer):
+        self.uploads[descriptor.path[0].decode('utf-8')] = reader.read_all()
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _frame(data):
+    return struct.pack('!I', len(data)) + data
+
+
+class BridgeEndToEndTest(unittest.TestCase):
+    COALESCE_ROWS = 100
+
+    @classmethod
+    def setUpClass(cls):
+        # Some tests break connections on purpose; keep their errors out of the output
+        cls.log_level = arrow_bridge.logger.level
+        arrow_bridge.logger.setLevel(logging.CRITICAL)
+        cls.server = RecordingFlightServer('grpc://127.0.0.1:0')
+        cls.bridge_port = _free_port()
+        bridge = arrow_bridge.ArrowBridge(cls.bridge_port, '127.0.0.1', cls.server.port,
+                                          coalesce_rows=cls.COALESCE_ROWS, small_query_rows=0)
+        threading.Thread(target=bridge.start, daemon=True).start()
+        deadline = time.time() + 60
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', cls.bridge_port)).close()
+                break
+            except OSError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.1)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        arrow_bridge.logger.setLevel(cls.log_level)
+
+    def _send(self, query_id, schema_frame, batch_frames, finish=True):
+        sock = socket.create_connection(('127.0.0.1', self.bridge_port))
+        try:
+            sock.sendall(_frame(query_id.encode('utf-8')) + _frame(schema_frame))
+            for batch in batch_frames:
+                sock.sendall(_frame(batch))
+            if not finish:
+                return None
+            sock.sendall(struct.pack('!I', 0))
+            return sock.recv(2)
+        finally:
+            sock.close()
+
+    def _upload(self, query_id, timeout=10):
+        deadline = time.time() + timeout
+        while query_id not in self.server.uploads:
+            if time.time() > deadline:
+                return None
+            time.sleep(0.05)
+        return self.server.uploads[query_id]
+
+    def _send_legacy(self, query_id, schema_frame, type_names, batch_sizes, seed=0):
+        rng = random.Random(seed)
+        expected = [[] for _ in type_names]
+        batches = []
+        for num_rows in batch_sizes:
+            data = _encode_batch(type_names, _random_batch(rng, type_names, num_rows, 0.2))
+            for values, column in zip(expected, _reference_parse(data, type_names)):
+                values += column
+            batches.append(data)
+        self.assertEqual(self._send(query_id, schema_frame, batches), b'OK')
+        return expected
+
+    def test_json_schema_stream(self):
+        type_names = ['INTEGER', 'VARCHAR', 'DOUBLE', 'BIGINT']
+        expected = self._send_legacy('json', _json_schema(type_names), type_names, [40, 0, 250, 3])
+        table = self._upload('json')
+        self.assertEqual([column.to_pylist() for column in table.columns], expected)
+
+    def test_column_descriptor_stream(self):
+        type_names = ['VARCHAR', 'BIGINT']
+        expected = self._send_legacy('descriptor', _descriptor_schema(type_names), type_names, [70, 70])
+        table = self._upload('descriptor')
+        self.assertEqual([column.to_pylist() for column in table.columns], expected)
+
+    def test_small_batches_are_coalesced(self):
+        type_names = ['INTEGER']
+        expected = self._send_legacy('coalesced', _json_schema(type_names), type_names, [10] * 25)
+        table = self._upload('coalesced')
+        self.assertEqual(table.column(0).to_pylist(), expected[0])
+        # 250 rows: two full coalesced messages, then the remainder at end of stream
+        self.assertEqual([batch.num_rows for batch in table.to_batches()], [100, 100, 50])
+
+    def test_ipc_stream(self):
+        schema = pa.schema([('a', pa.int32()), ('b', pa.string())])
+        batches = [
+            pa.record_batch([pa.array([1, None, 3], pa.int32()), pa.array(['x', 'y', None])], schema=schema),
+            pa.record_batch([pa.array([4], pa.int32()), pa.array(['é'])], schema=schema),
+        ]
+        frames = [batch.serialize().to_pybytes() for batch in batches]
+        self.assertEqual(self._send('ipc', schema.serialize().to_pybytes(), frames), b'OK')
+        self.assertTrue(self._upload('ipc').equals(pa.Table.from_batches(batches)))
+
+    def test_failed_connection_drops_held_back_rows(self):
+        type_names = ['INTEGER']
+        rng = random.Random(7)
+        batches = [_encode_batch(type_names, _random_batch(rng, type_names, 30, 0.0)) for _ in range(3)]
+        # Every batch is below COALESCE_ROWS, so nothing has been written when the
+        # truncated frame arrives
+        self._send('aborted', _json_schema(type_names), batches + [b'\x00\x00\x00\x05\x00'], finish=False)
+        table = self._upload('aborted', timeout=3)
+        self.assertTrue(table is None or table.num_rows == 0)
+
+    def test_bridge_survives_failed_connection(self):
+        self._send('broken', _json_schema(['INTEGER']), [b'\x00\x00\x00\x09'], finish=False)
+        expected = self._send_legacy('after_broken', _json_schema(['INTEGER']), ['INTEGER'], [5])
+        self.assertEqual(self._upload('after_broken').column(0).to_pylist(), expected[0])
+
+
+if __name__ == '__main__':
+    unittest.main()